@@ -1,14 +1,20 @@
 """Test deal-term-001 REST API."""
 
 import httpx
-from fastapi.testclient import TestClient
+import pytest
 
 from deal_term_001.api import app
 
-client = TestClient(app)
 
+@pytest.fixture()
+def anyio_backend() -> str:
+    """Run the async tests on asyncio only."""
+    return "asyncio"
 
-def test_read_root() -> None:
+
+@pytest.mark.anyio()
+async def test_read_root() -> None:
     """Test that reading the root is successful."""
-    response = client.get("/compute", params={"n": 7})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/compute", params={"n": 7})
     assert httpx.codes.is_success(response.status_code)
@@ -1,6 +1,8 @@
 """
 
 """
+from concurrent.futures import ThreadPoolExecutor
+
 import dspy
 from dspygen.utils.dspy_tools import init_dspy        
 
@@ -8,18 +10,11 @@ class SplitDealTerms(dspy.Signature):
     "split the deal_terms to the terms relevant for each month"
 
     deal_terms: str = dspy.InputField(desc="Deal terms to be split")
-    invoice_period1: str = dspy.OutputField(desc="invoice period 1 terms")
-    invoice_period2: str = dspy.OutputField(desc="invoice period 2 terms")
-    invoice_period3: str = dspy.OutputField(desc="invoice period 3 terms")
-    invoice_period4: str = dspy.OutputField(desc="invoice period 4 terms")
-    invoice_period5: str = dspy.OutputField(desc="invoice period 5 terms")
-    invoice_period6: str = dspy.OutputField(desc="invoice period 6 terms")
-    invoice_period7: str = dspy.OutputField(desc="invoice period 7 terms")
-    invoice_period8: str = dspy.OutputField(desc="invoice period 8 terms")
-    invoice_period9: str = dspy.OutputField(desc="invoice period 9 terms")
-    invoice_period10: str = dspy.OutputField(desc="invoice period 10 terms")
-    invoice_period11: str = dspy.OutputField(desc="invoice period 11 terms")
-    invoice_period12: str = dspy.OutputField(desc="invoice period 12 terms")
+    invoice_periods: list[str] = dspy.OutputField(desc="list of 12 invoice period terms, in order")
+
+
+# The signature is fixed, so the predictor is built once and shared by every module instance
+_split_deal_terms_pred = dspy.TypedChainOfThought(SplitDealTerms)
 
 
 class DealTermSplitModule(dspy.Module):
@@ -29,6 +24,8 @@ class DealTermSplitModule(dspy.Module):
         super().__init__()
         self.forward_args = forward_args
         self.output = None
+        # Registered as an attribute so named_predictors(), teleprompters and save/load see it
+        self.predictor = _split_deal_terms_pred
         
     def __or__(self, other):
         if other.output is None and self.output is None:
@@ -39,8 +36,7 @@ class DealTermSplitModule(dspy.Module):
         return other
 
     def forward(self, deal_terms):
-        pred = dspy.ChainOfThought(SplitDealTerms)
-        self.output = pred(deal_terms=deal_terms)
+        self.output = self.predictor(deal_terms=deal_terms).invoice_periods
         return self.output
         
     def pipe(self, input_str):
@@ -62,11 +58,19 @@ def call(deal_terms):
 
 
 
+# Repeated deal_terms are served by DSPy's joblib disk cache (on unless DSP_CACHEBOOL=false),
+# which keys on the full prompt and LM settings
 def deal_term_split_call(deal_terms):
     deal_term_split = DealTermSplitModule()
     return deal_term_split.forward(deal_terms=deal_terms)
 
 
+def deal_term_split_batch_call(deal_terms: list[str], num_threads: int = 16):
+    """Split several deal_terms strings concurrently, returning results in input order."""
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return list(executor.map(deal_term_split_call, deal_terms))
+
+
 
 def main():
     init_dspy()
@@ -76,16 +80,42 @@ def main():
 
 
 
+from asyncer import asyncify
 from fastapi import APIRouter
+from pydantic import BaseModel, Field
 router = APIRouter()
 
+# Each entry is a paid LM call, so a single request may only fan out to this many
+MAX_BATCH_DEAL_TERMS = 64
+
+
+class DealTermsBatch(BaseModel):
+    deal_terms: list[str] = Field(min_length=1, max_length=MAX_BATCH_DEAL_TERMS)
+
+
+def _ensure_dspy():
+    """Configure the default LM on first use, unless the hosting app has configured one already.
+
+    Runs on the event-loop thread rather than in the worker, because DSPy settings configured in
+    a worker thread do not carry over to the batch threads. This works whether or not the host
+    app runs router startup handlers (apps built with ``lifespan=`` do not).
+    """
+    if dspy.settings.lm is None:
+        init_dspy()
+
+
+# The DSPy calls block on the LM, so run them in a worker thread to keep the event loop free
 @router.post("/deal_term_split/")
 async def deal_term_split_route(data: dict):
-    # Your code generation logic here
-    init_dspy()
+    _ensure_dspy()
+    return await asyncify(deal_term_split_call)(**data)
+
 
-    print(data)
-    return deal_term_split_call(**data)
+@router.post("/deal_term_split_batch/")
+async def deal_term_split_batch_route(data: DealTermsBatch):
+    _ensure_dspy()
+    # Only the terms come from the client; the thread-pool size stays server-side
+    return await asyncify(deal_term_split_batch_call)(data.deal_terms)
 
 
 
@@ -1,3 +1,4 @@
+import functools
 import hashlib
 import dspy
 import ijson
@@ -21,13 +22,13 @@ from dspygen.utils.file_tools import data_dir, count_tokens
 
 
 def calculate_file_checksum(file_path: str) -> str:
-    hash_md5 = hashlib.md5()
-    print("Chromadb path: ", file_path)
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-            print(chunk)
-    return hash_md5.hexdigest()
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, "blake2b").hexdigest()
+        hash_blake2b = hashlib.blake2b()
+        for chunk in iter(lambda: f.read(1 << 18), b""):
+            hash_blake2b.update(chunk)
+    return hash_blake2b.hexdigest()
 
 
 # Pydantic models
@@ -92,6 +93,8 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
         self.persist_directory = Path(persist_directory)
         self.client = chromadb.PersistentClient(path=str(self.persist_directory))
         self.embedding_function = embed_fn
+        # Per-instance LRU so repeated queries skip the embedding round-trip
+        self._embed_query = functools.lru_cache(maxsize=1024)(self._embed_query_uncached)
         self.collection = self.client.get_or_create_collection(
             name=self.collection_name,
             embedding_function=self.embedding_function,
@@ -121,22 +124,27 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
         checksum_file.write_text(self.current_checksum)
 
     def _process_and_store_conversations(self):
+        # Load the stored ids once instead of probing the collection for every message
+        stored_ids = set(self.collection.get(include=[])["ids"])
+        # Per-node outcomes are counted and summarised rather than logged one line per node
+        added = skipped = 0
+
         with open(self.json_file_path, "rb") as json_file:
             count = -1
             while True:
                 try:
                     for conversation in ijson.items(json_file, "item"):
                         count += 1
-                        print(f"Processing conversation #{count} {conversation['title']}")
+                        if count % 1000 == 0:
+                            logger.info("Processing conversation #{} {} ({} documents added, {} already stored)",
+                                        count, conversation['title'], added, skipped)
                         try:
-                            validated_conversation = Conversation(**conversation)
+                            validated_conversation = Conversation.model_validate(conversation)
                             for _, data in validated_conversation.mapping.items():
-                                validated_data = Data(**data)
+                                validated_data = Data.model_validate(data)
 
-                                # Search if document already exists
-                                search_results = self.collection.get(ids=[validated_data.id])
-                                if len(search_results["ids"]) > 0:
-                                    logger.info(f"Skipping already existing document #{count} with ID: {validated_data.id}")
+                                if validated_data.id in stored_ids:
+                                    skipped += 1
                                     continue
 
                                 if validated_data.message and validated_data.message.content.parts:
@@ -153,7 +161,8 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
                                         metadatas=[{"id": validated_data.id}],
                                         ids=[validated_data.id],
                                     )
-                                    logger.debug(f"Added document with ID: {validated_data.id}")
+                                    stored_ids.add(validated_data.id)
+                                    added += 1
 
                         except ValidationError as e:
                             logger.error(f"Validation error: {e}")
@@ -162,15 +171,18 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
                     logger.error(f"JSON parsing error: {e}")
                     break  # Exit the loop if we encounter a JSON parsing error
 
+        logger.info("Processed {} conversations ({} documents added, {} already stored)", count + 1, added, skipped)
+
     def _update_collection_metadata(self):
+        updated = 0
         with open(self.json_file_path, "rb") as json_file:
             while True:
                 try:
                     for conversation in ijson.items(json_file, "item"):
                         try:
-                            validated_conversation = Conversation(**conversation)
+                            validated_conversation = Conversation.model_validate(conversation)
                             for _, data in validated_conversation.mapping.items():
-                                validated_data = Data(**data)
+                                validated_data = Data.model_validate(data)
 
                                 if validated_data.message and validated_data.message.content.parts:
                                     # Filter and process text parts only
@@ -184,7 +196,7 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
                                     meta.title = validated_conversation.title
 
                                     self.collection.update(metadatas=[meta], ids=[validated_data.id])
-                                    logger.debug(f"Updated document with ID: {validated_data.id}")
+                                    updated += 1
 
                         except ValidationError as e:
                             logger.error(f"Validation error: {e}")
@@ -193,6 +205,11 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
                     logger.error(f"JSON parsing error: {e}")
                     break  # Exit the loop if we encounter a JSON parsing error
 
+        logger.info("Updated metadata of {} documents", updated)
+
+    def _embed_query_uncached(self, query: str) -> tuple:
+        return tuple(self.embedding_function([query])[0])
+
     def forward(
         self,
         query_or_queries: Union[str, List[str]],
@@ -221,7 +238,7 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
             return []
 
         try:
-            embeddings = self.embedding_function(queries)
+            embeddings = [list(self._embed_query(q)) for q in queries]
         except Exception as e:
             logger.error(f"Error generating embeddings: {e}")
             return []
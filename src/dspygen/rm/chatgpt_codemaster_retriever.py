@@ -1,55 +1,120 @@
+import functools
 import hashlib
+import json
+import os
+import re
+import shelve
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
 import dspy
 import ijson
+import orjson
 from pathlib import Path
 from typing import List, Optional, Union
 
 from loguru import logger
 import chromadb
-import chromadb.utils.embedding_functions as embedding_functions
-from pydantic import BaseModel, ValidationError
+import requests
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
 
 from dspygen.utils.file_tools import data_dir
-from structured_code_desc_saver import save_code_snippets  # Import the save_code_snippets function
+from dspygen.rm.structured_code_desc_saver import save_code_snippets
 
 # Configure loguru logger
 logger.add("chatgpt_chromadb_retriever.log", rotation="10 MB", level="ERROR")
 
+# ijson already picks its fastest installed backend (yajl2_c when compiled); flag the slow fallback
+if ijson.backend == "python":
+    logger.warning("ijson is using its pure-Python backend; streaming large exports will be slow")
+
+# Exports below this size are parsed in one orjson call; larger ones are streamed with ijson
+IN_MEMORY_JSON_LIMIT = 512 * 1024 * 1024
+
+# A fenced block opens and closes on lines starting with ```; group 1 is the code between the fences
+CODE_BLOCK_RE = re.compile(r"^[ \t]*```[^\n]*\n(.*?)^[ \t]*```[^\n]*$", re.MULTILINE | re.DOTALL)
+
 def calculate_file_checksum(file_path: str) -> str:
-    hash_md5 = hashlib.md5()
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
-class Author(BaseModel):
-    role: str
-    name: Optional[str] = None
-    metadata: dict
-
-class ContentPart(BaseModel):
-    content_type: str
-    parts: Optional[List[Union[str, dict]]] = None
-
-class Message(BaseModel):
-    id: str
-    author: Author
-    content: ContentPart
-    status: str
-    metadata: dict
-
-class Data(BaseModel):
-    id: str
-    message: Optional[Message] = None
-    parent: Optional[str] = None
-    children: List[str]
-
-class Conversation(BaseModel):
-    title: str
-    mapping: dict
-
-default_embed_fn = embedding_functions.OllamaEmbeddingFunction(
-    url="http://localhost:11434/api/embeddings",
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, "blake2b").hexdigest()
+        hash_blake2b = hashlib.blake2b()
+        for chunk in iter(lambda: f.read(1 << 18), b""):
+            hash_blake2b.update(chunk)
+    return hash_blake2b.hexdigest()
+
+def calculate_conversation_checksum(conversation: dict) -> str:
+    serialized = json.dumps(conversation, sort_keys=True)
+    return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
+
+def conversation_key(conversation: dict) -> str:
+    return conversation.get("conversation_id") or conversation.get("id") or conversation["title"]
+
+def read_node(node: dict) -> tuple[str, Optional[str], Optional[list]]:
+    """Return the (id, author role, content parts) of a conversation mapping node.
+
+    Only the fields used downstream are read, straight from the parsed dict. Malformed nodes
+    raise KeyError, TypeError or AttributeError.
+    """
+    message = node.get("message")
+    if not message:
+        return node["id"], None, None
+    return node["id"], message["author"]["role"], message["content"].get("parts")
+
+def extract_code_and_text(parts: List[Union[str, dict]]) -> (List[str], List[str]):
+    """Split the string parts of a message into fenced code snippets and surrounding text.
+
+    ``non_code_text[i]`` is the text preceding ``code_snippets[i]`` (empty if there is none), so the
+    two lists zip into (snippet, description) pairs. Text before an empty block carries over to the
+    next snippet; text left after the last snippet follows as separate entries.
+    """
+    text = "\n".join(part for part in parts if isinstance(part, str))
+    code_snippets = []
+    non_code_text = []
+    text_segments = []
+    position = 0
+
+    for match in CODE_BLOCK_RE.finditer(text):
+        segment = text[position:match.start()].strip()
+        if segment:
+            text_segments.append(segment.replace("\n", " "))
+        code = match.group(1).removesuffix("\n")
+        if code:
+            code_snippets.append(code)
+            non_code_text.append(" ".join(text_segments))
+            text_segments = []
+        position = match.end()
+
+    trailing_text = text[position:].strip()
+    if trailing_text:
+        text_segments.append(trailing_text.replace("\n", " "))
+    non_code_text.extend(text_segments)
+
+    return code_snippets, non_code_text
+
+class OllamaBatchEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Embed a list of documents with a single request to Ollama's batch /api/embed endpoint.
+
+    Chroma's OllamaEmbeddingFunction posts to /api/embeddings once per document, so an upsert of
+    200 snippets costs 200 HTTP round-trips; this sends them as one ``input`` array instead.
+    """
+
+    def __init__(self, url: str, model_name: str, timeout: float = 300):
+        self.url = url
+        self.model_name = model_name
+        self.timeout = timeout
+
+    def __call__(self, input: Documents) -> Embeddings:
+        response = requests.post(
+            self.url,
+            json={"model": self.model_name, "input": list(input)},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+default_embed_fn = OllamaBatchEmbeddingFunction(
+    url="http://localhost:11434/api/embed",
     model_name="llama3",
 )
 
@@ -62,15 +127,29 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
         check_for_updates: bool = True,
         embed_fn=default_embed_fn,
         k=5,
+        batch_size: int = 200,
+        max_workers: int = 4,
+        dump_snippets: bool = False,
+        chroma_host: Optional[str] = None,
+        chroma_port: int = 8000,
     ):
         """Initialize the ChatGPTChromaDBRetriever."""
         super().__init__(k)
         self.json_file_path = json_file_path
         self.collection_name = collection_name
         self.k = k
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.dump_snippets = dump_snippets
         self.persist_directory = Path(persist_directory)
-        self.client = chromadb.PersistentClient(path=str(self.persist_directory))
+        if chroma_host:
+            # A Chroma server lets several indexing processes write to the same collection
+            self.client = chromadb.HttpClient(host=chroma_host, port=chroma_port)
+        else:
+            self.client = chromadb.PersistentClient(path=str(self.persist_directory))
         self.embedding_function = embed_fn
+        # Per-instance LRU so repeated queries skip the embedding round-trip
+        self._embed_query = functools.lru_cache(maxsize=1024)(self._embed_query_uncached)
         self.collection = self.client.get_or_create_collection(
             name=self.collection_name,
             embedding_function=self.embedding_function,
@@ -99,130 +178,164 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
         checksum_file = self.persist_directory / "last_checksum.txt"
         checksum_file.write_text(self.current_checksum)
 
-    def _process_and_store_conversations(self):
+    def _process_and_store_conversations(self, force: bool = False, shard_path: Optional[str] = None):
+        json_file_path = shard_path or self.json_file_path
+        # Each shard keeps its own checksum sidecar so processes never share a dbm file
+        checksums_name = f"conv_hashes_{Path(shard_path).stem}" if shard_path else "conv_hashes"
         temp_code_directory = Path("data/temp_code")
-        temp_code_directory.mkdir(parents=True, exist_ok=True)
-        
-        with open(self.json_file_path, "rb") as json_file:
+        if self.dump_snippets:
+            temp_code_directory.mkdir(parents=True, exist_ok=True)
+
+        # Document ids embed the snippet hash, so a known id means the snippet is already embedded;
+        # a forced run starts empty so every snippet is upserted again with its current metadata
+        stored_ids = set() if force else set(self.collection.get(include=[])["ids"])
+        pending = {}
+        pending_files = []
+        in_flight = deque()
+        # Per-conversation checksums are only persisted after the final flush so an interrupted
+        # run never marks a conversation as done while its snippets are still buffered
+        processed_checksums = {}
+
+        # Parsing stays on this thread; embedding requests and collection writes run on the pool
+        with open(json_file_path, "rb") as json_file, \
+                shelve.open(str(self.persist_directory / checksums_name)) as conversation_checksums, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
             count = -1
+            unchanged = 0
             while True:
                 try:
-                    for conversation in ijson.items(json_file, "item"):
+                    for conversation in self._iter_conversations(json_file, json_file_path):
                         count += 1
-                        print(f"Processing conversation #{count} {conversation['title']}")
+                        if count % 1000 == 0:
+                            logger.info("Processing conversation #{} {} ({} unchanged so far)",
+                                        count, conversation['title'], unchanged)
                         if conversation['title'] == "Create Python PUF Assets":
-                            temp_code_directory = Path(f"data/temp_code/{conversation['title']}")
-                            temp_code_directory.mkdir(parents=True, exist_ok=True)
+                            conversation_id = conversation_key(conversation)
+                            conversation_checksum = calculate_conversation_checksum(conversation)
+                            if not force and conversation_checksums.get(conversation_id) == conversation_checksum:
+                                unchanged += 1
+                                continue
+
+                            # Only node parsing is guarded, so worker errors from _submit_batch propagate
                             try:
-                                validated_conversation = Conversation(**conversation)
-                                chat_count = -1
-                                for _, data in validated_conversation.mapping.items():
-                                    validated_data = Data(**data)
-
-                                    if validated_data.message and validated_data.message.content.parts:
-                                        # Detect and process code snippets
-                                        code_snippets, non_code_text = self._extract_code_and_text(validated_data.message.content.parts)
-                                        chat_count +=1
-                                        if code_snippets:
-                                            for snippet, description in zip(code_snippets, non_code_text):
-                                                document_id = f"{validated_data.id}_{hashlib.md5(snippet.encode()).hexdigest()}"
-                                                temp_code_directory = Path(f"data/temp_code/{conversation['title']}/{chat_count}_{validated_data.id}")
-                                                temp_code_directory.mkdir(parents=True, exist_ok=True)
-                                                # Check if the document already exists
-                                                search_results = self.collection.get(ids=[document_id])
-                                                if len(search_results["ids"]) > 0:
-                                                    # Update existing document
-                                                    self.collection.update(
-                                                        ids=[document_id],
-                                                        documents=[snippet],
-                                                        metadatas=[{"id": validated_data.id, "description": description}]
-                                                    )
-                                                    logger.debug(f"Updated document with ID: {document_id}")
-                                                else:
-                                                    # Add new document
-                                                    self.collection.add(
-                                                        documents=[snippet],
-                                                        metadatas=[{"id": validated_data.id, "description": description}],
-                                                        ids=[document_id],
-                                                    )
-                                                    logger.debug(f"Added document with ID: {document_id}")
-
-                                                # Save to temp code directory
-                                                save_code_snippets(temp_code_directory, document_id, snippet, description)  # Call the external function
-
-                            except ValidationError as e:
-                                logger.error(f"Validation error: {e}")
+                                nodes = [read_node(data) for data in conversation["mapping"].values()]
+                            except (KeyError, TypeError, AttributeError) as e:
+                                logger.error(f"Malformed conversation #{count}: {e!r}")
+                                continue
+
+                            conversation_directory = temp_code_directory / conversation['title']
+                            if self.dump_snippets:
+                                conversation_directory.mkdir(exist_ok=True)
+                            chat_count = -1
+                            for node_id, _, parts in nodes:
+                                if parts:
+                                    # Detect and process code snippets
+                                    code_snippets, non_code_text = extract_code_and_text(parts)
+                                    chat_count +=1
+                                    if code_snippets:
+                                        message_directory = conversation_directory / f"{chat_count}_{node_id}"
+                                        if self.dump_snippets:
+                                            message_directory.mkdir(exist_ok=True)
+                                        for snippet, description in zip(code_snippets, non_code_text):
+                                            document_id = f"{node_id}_{hashlib.md5(snippet.encode(), usedforsecurity=False).hexdigest()}"
+                                            if document_id not in stored_ids:
+                                                stored_ids.add(document_id)
+                                                pending[document_id] = (snippet, {"id": node_id, "description": description})
+                                                if len(pending) >= self.batch_size:
+                                                    self._submit_batch(executor, in_flight, self._upsert_batch, pending)
+
+                                            if self.dump_snippets:
+                                                pending_files.append((message_directory, document_id, snippet, description))
+                                                if len(pending_files) >= self.batch_size:
+                                                    self._submit_batch(executor, in_flight, self._save_snippet_files, pending_files)
+
+                            processed_checksums[conversation_id] = conversation_checksum
                     break
-                except ijson.JSONError as e:
-                    logger.error(f"JSON parsing error: {e}")
+                except (ijson.JSONError, orjson.JSONDecodeError) as e:
+                    logger.error(f"JSON parsing error near byte {json_file.tell()} after conversation #{count}: {e}")
                     break
 
-    def _extract_code_and_text(self, parts: List[Union[str, dict]]) -> (List[str], List[str]):
-        code_snippets = []
-        non_code_text = []
-        is_code_block = False
-        current_code = []
-        current_text = []
-
-        for part in parts:
-            if isinstance(part, str):
-                lines = part.split("\n")
-                for line in lines:
-                    if line.strip().startswith("```") and not is_code_block:
-                        is_code_block = True
-                        if current_text:
-                            non_code_text.append(" ".join(current_text))
-                            current_text = []
-                        continue
-                    elif line.strip().startswith("```") and is_code_block:
-                        is_code_block = False
-                        if current_code:
-                            code_snippets.append("\n".join(current_code))
-                            current_code = []
-                        continue
-
-                    if is_code_block:
-                        current_code.append(line)
-                    else:
-                        current_text.append(line)
-
-        if current_text:
-            non_code_text.append(" ".join(current_text))
-
-        return code_snippets, non_code_text
+            self._submit_batch(executor, in_flight, self._upsert_batch, pending)
+            self._submit_batch(executor, in_flight, self._save_snippet_files, pending_files)
+            while in_flight:
+                in_flight.popleft().result()
+            conversation_checksums.update(processed_checksums)
+            logger.info("Processed {} conversations ({} unchanged)", count + 1, unchanged)
+
+    def _iter_conversations(self, json_file, json_file_path):
+        """Yield the conversations of the export or JSON-lines shard, in file order."""
+        if Path(json_file_path).suffix == ".jsonl":
+            for line in json_file:
+                yield orjson.loads(line)
+        elif os.path.getsize(json_file_path) < IN_MEMORY_JSON_LIMIT:
+            yield from orjson.loads(json_file.read())
+        else:
+            # use_float keeps numbers identical to the orjson path, so conversation checksums match
+            yield from ijson.items(json_file, "item", use_float=True)
+
+    def _submit_batch(self, executor: ThreadPoolExecutor, in_flight: deque, write_fn, pending: Union[dict, list]):
+        """Hand a copy of the pending buffer to ``write_fn`` on a worker and clear the buffer.
+
+        At most ``2 * max_workers`` batches are queued; beyond that the oldest one is awaited first,
+        which bounds memory and re-raises worker errors on the parsing thread.
+        """
+        if not pending:
+            return
+
+        if len(in_flight) >= 2 * self.max_workers:
+            in_flight.popleft().result()
+        in_flight.append(executor.submit(write_fn, pending.copy()))
+        pending.clear()
+
+    def _upsert_batch(self, batch: dict):
+        """Write a batch of documents to the collection in a single upsert."""
+        self.collection.upsert(
+            ids=list(batch),
+            documents=[document for document, _ in batch.values()],
+            metadatas=[metadata for _, metadata in batch.values()],
+        )
+        logger.debug("Upserted {} documents", len(batch))
+
+    def _save_snippet_files(self, files: list):
+        """Write a batch of (directory, document_id, snippet, description) entries to temp code files."""
+        for directory, document_id, snippet, description in files:
+            save_code_snippets(directory, document_id, snippet, description)
 
     def _update_collection_metadata(self):
+        updated = 0
         with open(self.json_file_path, "rb") as json_file:
             while True:
                 try:
-                    for conversation in ijson.items(json_file, "item"):
+                    for conversation in self._iter_conversations(json_file, self.json_file_path):
                         try:
-                            validated_conversation = Conversation(**conversation)
-                            for _, data in validated_conversation.mapping.items():
-                                validated_data = Data(**data)
-
-                                if validated_data.message and validated_data.message.content.parts:
-                                    # Filter and process text parts only
-                                    document_text = ' '.join(
-                                        part for part in validated_data.message.content.parts if isinstance(part, str)
-                                    )
-
-                                    meta = {
-                                        "id": validated_data.id,
-                                        "role": validated_data.message.author.role,
-                                        "title": validated_conversation.title
-                                    }
-
-                                    self.collection.update(metadatas=[meta], ids=[validated_data.id])
-                                    logger.debug(f"Updated document with ID: {validated_data.id}")
-
-                        except ValidationError as e:
-                            logger.error(f"Validation error: {e}")
+                            title = conversation["title"]
+                            if not isinstance(title, str):
+                                raise TypeError(f"title must be a string, got {type(title).__name__}")
+                            nodes = [read_node(data) for data in conversation["mapping"].values()]
+                        except (KeyError, TypeError, AttributeError) as e:
+                            logger.error(f"Malformed conversation: {e!r}")
+                            continue
+
+                        for node_id, role, parts in nodes:
+                            if parts:
+                                meta = {
+                                    "id": node_id,
+                                    "role": role,
+                                    "title": title
+                                }
+
+                                self.collection.update(metadatas=[meta], ids=[node_id])
+                                updated += 1
                     break
-                except ijson.JSONError as e:
+                except (ijson.JSONError, orjson.JSONDecodeError) as e:
                     logger.error(f"JSON parsing error: {e}")
                     break
 
+        logger.info("Updated metadata of {} documents", updated)
+
+    def _embed_query_uncached(self, query: str) -> tuple:
+        return tuple(self.embedding_function([query])[0])
+
     def forward(
         self,
         query_or_queries: Union[str, List[str]],
@@ -250,7 +363,7 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
             return []
 
         try:
-            embeddings = self.embedding_function(queries)
+            embeddings = [list(self._embed_query(q)) for q in queries]
         except Exception as e:
             logger.error(f"Error generating embeddings: {e}")
             return []
@@ -287,52 +400,29 @@ class ChatGPTChromaDBRetriever(dspy.Retrieve):
                 for doc, meta in zip(documents, metadatas)]
 
     def generate_powershell_script(self, code_files: List[str], directory_structure: str):
-        script_lines = [
-            "# PowerShell script to create directories and files",
-            f'$baseDir = "{directory_structure}"',
-            "",
-            "# Define directories",
-            "$directories = @(",
-            '"$baseDir/src/dspygen/rm",',
-            '"$baseDir/src/dspygen/utils",',
-            '"$baseDir/src/dspygen/modules",',
-            '"$baseDir/data/chatgpt_logs"',
-            ")",
-            "",
-            "# Create directories",
-            "foreach ($dir in $directories) {",
-            "    if (-not (Test-Path -Path $dir)) {",
-            "        New-Item -ItemType Directory -Path $dir -Force",
-            "    }",
-            "}",
-            "",
-            "# Create files",
-            "$files = @(",
-        ]
-
-        for code_file in code_files:
-            script_lines.append(f'"{code_file}",')
-
-        script_lines += [
-            ")",
-            "",
-            "foreach ($file in $files) {",
-            "    if (-not (Test-Path -Path $file)) {",
-            "        New-Item -ItemType File -Path $file -Force",
-            "    }",
-            "}",
-            "",
-            'Write-Host "Directories and files have been created successfully."',
-        ]
-
-        script_content = "\n".join(script_lines)
-        script_path = Path("create_structure.ps1")
-        script_path.write_text(script_content)
-        logger.info(f"PowerShell script generated at {script_path}")
+        from dspygen.rm.chatgpt_codemaster_scripts import generate_powershell_script
+
+        return generate_powershell_script(code_files, directory_structure)
+
+
+def _process_shard(shard_path: str, **retriever_kwargs):
+    retriever = ChatGPTChromaDBRetriever(check_for_updates=False, **retriever_kwargs)
+    retriever._process_and_store_conversations(shard_path=shard_path)
+
+
+def process_shards(shard_paths: List[str], processes: int, chroma_host: str, chroma_port: int = 8000, **retriever_kwargs):
+    """Index conversation shards in parallel processes, each writing to a shared Chroma server.
+
+    A server is required: several processes cannot safely share one PersistentClient directory.
+    """
+    worker = functools.partial(_process_shard, chroma_host=chroma_host, chroma_port=chroma_port, **retriever_kwargs)
+    with Pool(processes) as pool:
+        pool.map(worker, [str(shard_path) for shard_path in shard_paths])
+
 
 def main():
     retriever = ChatGPTChromaDBRetriever(check_for_updates=True)
-    retriever._process_and_store_conversations()  # use only for enforced overriding
+    retriever._process_and_store_conversations(force=True)  # use only for enforced overriding
     #retriever._update_collection_metadata()
 
     query = "Please provide the code to create a Tetris game in Python."
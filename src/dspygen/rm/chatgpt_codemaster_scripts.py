@@ -0,0 +1,18 @@
+"""Helper scripts for the ChatGPT codemaster retriever, kept out of the retriever's import path."""
+from pathlib import Path
+from typing import List
+
+from jinja2 import Template
+from loguru import logger
+
+from dspygen.utils.file_tools import templates_dir
+
+
+def generate_powershell_script(code_files: List[str], directory_structure: str) -> Path:
+    """Write create_structure.ps1, which creates the project directories and the given code files."""
+    template = Template(templates_dir("create_structure.ps1.j2").read_text())
+    script_content = template.render(code_files=code_files, directory_structure=directory_structure)
+    script_path = Path("create_structure.ps1")
+    script_path.write_text(script_content)
+    logger.info(f"PowerShell script generated at {script_path}")
+    return script_path
@@ -0,0 +1,69 @@
+"""Split a ChatGPT conversations.json export into JSON-lines shards and index them in parallel."""
+import hashlib
+from pathlib import Path
+from typing import List
+
+import ijson
+import orjson
+from loguru import logger
+from typer import Typer
+
+from dspygen.rm.chatgpt_codemaster_retriever import conversation_key, process_shards
+from dspygen.utils.file_tools import data_dir
+
+app = Typer()
+
+
+def shard_conversations(json_file_path: str, output_directory: str, num_shards: int) -> List[Path]:
+    """Stream the export with ijson and write each conversation to one of ``num_shards`` .jsonl files.
+
+    Shards are chosen by a hash of the conversation id, so a conversation lands in the same shard
+    on every run and its per-shard checksum stays valid.
+    """
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    # Remove shards from an earlier split, which index would otherwise pick up alongside the new ones
+    for stale_shard_path in output_directory.glob("conversations_*.jsonl"):
+        stale_shard_path.unlink()
+    shard_paths = [output_directory / f"conversations_{i:03d}.jsonl" for i in range(num_shards)]
+
+    shard_files = [shard_path.open("wb") for shard_path in shard_paths]
+    try:
+        with open(json_file_path, "rb") as json_file:
+            for count, conversation in enumerate(ijson.items(json_file, "item", use_float=True)):
+                key_digest = hashlib.blake2b(conversation_key(conversation).encode(), digest_size=8).digest()
+                shard_files[int.from_bytes(key_digest, "big") % num_shards].write(orjson.dumps(conversation) + b"\n")
+                if count % 1000 == 0:
+                    logger.info(f"Sharded conversation #{count}")
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+
+    return shard_paths
+
+
+@app.command()
+def split(
+    json_file_path: str = str(data_dir() / "chatgpt_logs" / "conversations.json"),
+    output_directory: str = str(data_dir() / "chatgpt_logs" / "shards"),
+    num_shards: int = 8,
+):
+    """Split conversations.json into JSON-lines shards."""
+    for shard_path in shard_conversations(json_file_path, output_directory, num_shards):
+        print(shard_path)
+
+
+@app.command()
+def index(
+    chroma_host: str,
+    chroma_port: int = 8000,
+    shard_directory: str = str(data_dir() / "chatgpt_logs" / "shards"),
+    processes: int = 8,
+):
+    """Index every shard in parallel processes against a running Chroma server."""
+    shard_paths = sorted(Path(shard_directory).glob("*.jsonl"))
+    process_shards(shard_paths, processes, chroma_host=chroma_host, chroma_port=chroma_port)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,40 @@
+"""Test the deal_term_split batch route."""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from dspygen.modules import deal_term_split_module
+from dspygen.modules.deal_term_split_module import MAX_BATCH_DEAL_TERMS, router
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def fake_split(monkeypatch):
+    """Replace the LM-backed split with one that echoes its input."""
+    monkeypatch.setattr(deal_term_split_module, "init_dspy", lambda: None)
+    monkeypatch.setattr(deal_term_split_module, "deal_term_split_call", lambda deal_terms: [deal_terms])
+
+
+def test_batch_route_returns_results_in_order() -> None:
+    response = client.post("/deal_term_split_batch/", json={"deal_terms": ["a", "b", "c"]})
+    assert response.status_code == 200
+    assert response.json() == [["a"], ["b"], ["c"]]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"deal_terms": "abc"},
+        {},
+        {"deal_terms": []},
+        {"deal_terms": ["terms"] * (MAX_BATCH_DEAL_TERMS + 1)},
+        {"deal_terms": [1, None]},
+    ],
+)
+def test_batch_route_rejects_invalid_bodies(body) -> None:
+    response = client.post("/deal_term_split_batch/", json=body)
+    assert response.status_code == 422
@@ -0,0 +1,33 @@
+from dspygen.rm.chatgpt_codemaster_retriever import extract_code_and_text
+
+
+def test_pairs_leading_text_with_snippet():
+    parts = ["Here is the code:\n```python\nprint(1)\nx = 2\n```\nThat's all"]
+    assert extract_code_and_text(parts) == (["print(1)\nx = 2"], ["Here is the code:", "That's all"])
+
+
+def test_snippet_without_leading_text_gets_empty_description():
+    parts = ["```\nfirst\n```\nbetween\n```js\nsecond\n```"]
+    assert extract_code_and_text(parts) == (["first", "second"], ["", "between"])
+
+
+def test_keeps_text_around_empty_block():
+    assert extract_code_and_text(["x\n```\n```\ny"]) == ([], ["x", "y"])
+
+
+def test_text_before_empty_block_carries_to_next_snippet():
+    parts = ["x\n```\n```\ny\n```\ncode\n```"]
+    assert extract_code_and_text(parts) == (["code"], ["x y"])
+
+
+def test_unclosed_fence_is_text():
+    assert extract_code_and_text(["a\n```\nunclosed"]) == ([], ["a ``` unclosed"])
+
+
+def test_fence_split_across_parts():
+    parts = ["intro\n```python", {"content_type": "image"}, "print(1)", "```\noutro"]
+    assert extract_code_and_text(parts) == (["print(1)"], ["intro", "outro"])
+
+
+def test_no_code():
+    assert extract_code_and_text(["just\ntext"]) == ([], ["just text"])
@@ -0,0 +1,50 @@
+import json
+
+from dspygen.rm.shard_conversations import shard_conversations
+
+
+def write_export(path, conversation_ids):
+    conversations = [{"conversation_id": cid, "title": f"Title {cid}", "mapping": {}} for cid in conversation_ids]
+    path.write_text(json.dumps(conversations))
+    return path
+
+
+def read_shards(shard_paths):
+    return {
+        shard_path.name: [json.loads(line)["conversation_id"] for line in shard_path.read_text().splitlines()]
+        for shard_path in shard_paths
+    }
+
+
+def test_every_conversation_is_written_to_exactly_one_shard(tmp_path):
+    export = write_export(tmp_path / "conversations.json", [f"c{i}" for i in range(20)])
+
+    shards = read_shards(shard_conversations(export, tmp_path / "shards", 4))
+
+    assert len(shards) == 4
+    assert sorted(cid for cids in shards.values() for cid in cids) == sorted(f"c{i}" for i in range(20))
+
+
+def test_shard_routing_is_stable_across_reruns(tmp_path):
+    first = write_export(tmp_path / "first.json", ["a", "b", "c", "d", "e"])
+    second = write_export(tmp_path / "second.json", ["x", "e", "d", "c", "b", "a", "y"])
+
+    first_shards = read_shards(shard_conversations(first, tmp_path / "shards", 3))
+    second_shards = read_shards(shard_conversations(second, tmp_path / "shards", 3))
+
+    def shard_of(shards, cid):
+        return next(name for name, cids in shards.items() if cid in cids)
+
+    for cid in ["a", "b", "c", "d", "e"]:
+        assert shard_of(first_shards, cid) == shard_of(second_shards, cid)
+
+
+def test_split_removes_shards_from_a_previous_run(tmp_path):
+    export = write_export(tmp_path / "conversations.json", [f"c{i}" for i in range(10)])
+    output_directory = tmp_path / "shards"
+
+    shard_conversations(export, output_directory, 4)
+    shard_paths = shard_conversations(export, output_directory, 2)
+
+    assert sorted(output_directory.glob("*.jsonl")) == sorted(shard_paths)
+    assert sum(len(cids) for cids in read_shards(shard_paths).values()) == 10